@@ -23,28 +23,167 @@
 # -----------------------------------------------------------------------------
 
 
-import os,sys,struct,zlib,time
+import os,sys,struct,time,queue,threading,hmac,mmap,getpass
 import serial
+from usb_bridge_crc import crc32, BACKEND as CRC_BACKEND
+from usb_bridge_port import tune_port
 
-CHUNK = 4096
+# optional: authenticated mode (GMAC tag instead of CRC32)
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+except ImportError:
+    AESGCM = None
+
+CHUNK = 32768  # length field is !H, so keep below 64 KiB
 BAUD = 115200
 # No timeout -> blocking reads. Exit with Ctrl+C.
 HEADER_RETRIES = 10
 CHUNK_RETRIES = 5
+WINDOW = 8  # packets in flight (8 x 32 KiB) before waiting on an ACK
+ACK_EVERY = 4  # receiver ACKs cumulatively every few packets (or when the line goes idle)
+WRITE_BUFFER = 1 << 20  # receiver file buffer
+
+# precompiled packet layouts: SEQ(4) LEN(2) payload CRC(4); replies are ACK/NAK + SEQ(4)
+PKT_HDR = struct.Struct('!IH')
+CRC_STRUCT = struct.Struct('!I')
+SEQ_STRUCT = struct.Struct('!I')
+
+# header MODE byte: 0 = CRC32 trailer, 1 = 16-byte AES-GMAC tag over the payload
+# (SEQ is bound through the nonce, LEN through GCM's length block)
+MODE_CRC, MODE_AUTH = 0, 1
+TAG_LEN = 16
+NONCE_PREFIX_LEN = 8  # random per transfer; nonce = prefix + SEQ(4), also the KDF salt
+# auth mode also tags the FILE header and the DONE marker; their nonces use SEQ values
+# no packet reaches, and DONE carries the frame count so truncation is detected
+HDR_SEQ, DONE_SEQ = 0xFFFFFFFF, 0xFFFFFFFE
+
+PROGRESS_INTERVAL = 0.05  # redraw the bar at most ~20 times a second
+_last_draw = 0.0
 
 def progress_bar(sent, total, width=30):
+    global _last_draw
+    now = time.monotonic()
+    if sent != total and now - _last_draw < PROGRESS_INTERVAL:
+        return
+    _last_draw = now
     pct = sent/total if total else 1
     filled = int(width*pct)
     bar = '[' + '#' * filled + '-'*(width-filled) + ']'
     print(f"\r{bar} {pct*100:6.2f}% {sent}/{total} bytes", end='', flush=True)
 
-def send(port, filepath):
+def raw_fd(s):
+    # POSIX: blocking raw fd so the hot loop skips pyserial's per-call bookkeeping.
+    # None on Windows, where the helpers below fall back to pyserial.
+    try:
+        fd = s.fileno()
+    except Exception:
+        return None
+    import termios
+    attrs = termios.tcgetattr(fd)
+    attrs[6][termios.VMIN] = 1  # pyserial polls with VMIN=0; block for at least one byte instead
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    os.set_blocking(fd, True)
+    return fd
+
+def read_exact(s, fd, view):
+    if fd is None:
+        return s.readinto(view)
+    n = 0
+    while n < len(view):
+        r = os.readv(fd, [view[n:]])
+        if not r:
+            break
+        n += r
+    return n
+
+def write_all(s, fd, data):
+    if fd is None:
+        s.write(data); return
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def write_parts(s, fd, parts):
+    # gathered write of several buffers; one writev syscall on POSIX
+    if fd is None:
+        s.write(b''.join(parts)); return
+    parts = [memoryview(p) for p in parts]
+    while parts:
+        n = os.writev(fd, parts)
+        while parts and n >= len(parts[0]):
+            n -= len(parts[0]); parts.pop(0)
+        if parts:
+            parts[0] = parts[0][n:]
+
+def _ack_reader(s, acks, stop):
+    while not stop.is_set():
+        try:
+            r = s.read(7)  # ACK/NAK + seq(4)
+        except Exception:
+            return
+        if len(r) == 7:
+            acks.put(r)
+
+def make_auth(passphrase, prefix):
+    # (AESGCM, nonce prefix) for auth mode. The key is stretched with scrypt, salted
+    # with the per-transfer prefix, so a captured tag does not allow a cheap offline
+    # passphrase search.
+    key = Scrypt(salt=prefix, length=32, n=1 << 15, r=8, p=1).derive(passphrase.encode())
+    return AESGCM(key), prefix
+
+def gmac(auth, seq, view):
+    # AES-GCM with empty plaintext: the 16-byte output is the tag over view.
+    # A resend reuses the nonce with identical data, which yields the same tag.
+    aes, prefix = auth
+    return aes.encrypt(prefix + SEQ_STRUCT.pack(seq), b'', view)
+
+def _framer(mmv, size, bufs, free, ready, auth):
+    # producer for send(): frames header + CRC/tag for each CHUNK of the mapped file
+    # into a free slot; yields (seq, slot, offset, length), None at EOF
+    seq = 0
+    # hot loop: bind lookups to locals
+    get, put = free.get, ready.put
+    pack_hdr, pack_crc, _crc32 = PKT_HDR.pack_into, CRC_STRUCT.pack_into, crc32
+    for off in range(0, size, CHUNK):
+        i = get()
+        if i is None:
+            break
+        n = min(CHUNK, size - off)
+        pack_hdr(bufs[i], 0, seq, n)
+        if auth:
+            bufs[i][6:6 + TAG_LEN] = gmac(auth, seq, mmv[off:off + n])
+        else:
+            pack_crc(bufs[i], 6, _crc32(mmv[off:off + n]))
+        put((seq, i, off, n))
+        seq += 1
+    put(None)
+
+def _close(s, stop):
+    stop.set()
+    try:
+        s.cancel_read()  # wake the ACK reader blocked in read()
+    except Exception:
+        pass
+    s.close()
+
+def send(port, filepath, passphrase=None):
     if not os.path.isfile(filepath):
         print("File not found:", filepath); return
     size = os.path.getsize(filepath)
     fname = os.path.basename(filepath).encode()
-    hdr = b'FILE' + struct.pack('!B', len(fname)) + fname + struct.pack('!Q', size)
+    auth = None
+    if passphrase:
+        auth = make_auth(passphrase, os.urandom(NONCE_PREFIX_LEN))
+        hdr = struct.Struct(f'!4sBB{len(fname)}sQ{NONCE_PREFIX_LEN}s').pack(
+            b'FILE', MODE_AUTH, len(fname), fname, size, auth[1])
+        hdr += gmac(auth, HDR_SEQ, hdr)
+    else:
+        hdr = struct.Struct(f'!4sBB{len(fname)}sQ').pack(b'FILE', MODE_CRC, len(fname), fname, size)
+    tlen = TAG_LEN if auth else 4
     s = serial.Serial(port, BAUD, timeout=None)
+    tune_port(s)
     # handshake header
     for i in range(HEADER_RETRIES):
         s.write(hdr)
@@ -53,38 +192,101 @@ def send(port, filepath):
         time.sleep(0.3)
     else:
         print("No OK from receiver. Check connection and run receiver first."); s.close(); return
+    fd = raw_fd(s)
+    # sliding window: keep up to WINDOW packets on the wire, ACKs come back on a reader thread
+    # (the reader stays on pyserial so _close() can cancel its blocking read)
+    acks = queue.Queue()
+    stop = threading.Event()
+    reader = threading.Thread(target=_ack_reader, args=(s, acks, stop), daemon=True)
+    reader.start()
+    # The file is memory-mapped: payloads go out as zero-copy views, gathered with the
+    # packet header and CRC/tag from a small per-slot buffer. A producer thread CRCs and
+    # frames chunks into free slots while we write; a slot is reused once its packet is ACKed.
+    bufs = [bytearray(6 + tlen) for _ in range(WINDOW)]
+    views = [memoryview(b) for b in bufs]
+    free = queue.Queue()
+    for i in range(WINDOW):
+        free.put(i)
+    ready = queue.Queue()
+    # cleanup runs on every exit path (SerialException, Ctrl+C): producer stopped,
+    # mapping and port closed
+    try:
+        with open(filepath, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''  # empty files can't be mapped
+            try:
+                with memoryview(mm) as mmv:
+                    framer = threading.Thread(target=_framer, args=(mmv, size, bufs, free, ready, auth), daemon=True)
+                    framer.start()
+                    try:
+                        ok = _pump(s, fd, mmv, size, views, free, ready, acks, tlen)
+                    finally:
+                        free.put(None)  # stop the producer if we bailed out early
+                        framer.join()
+            finally:
+                if size:
+                    try:
+                        mm.close()
+                    except BufferError:
+                        pass  # a traceback still holds a payload view; unmapped once it is freed
+        if not ok:
+            return
+        done = b'DONE'
+        if auth:
+            done += SEQ_STRUCT.pack(-(-size // CHUNK))  # frame count
+            done += gmac(auth, DONE_SEQ, done)
+        s.write(done)
+        progress_bar(size, size)
+        print("\nSend complete ->", filepath)
+    finally:
+        _close(s, stop)
+
+def _pump(s, fd, mmv, size, views, free, ready, acks, tlen):
+    # window loop of send(); False if a chunk ran out of retries
+    ack_timeout = 1.0 + 3 * (CHUNK + 6 + tlen) * 10 / BAUD  # a few packet air-times
+    pending = {}  # seq -> [slot, offset, length, tries]
     sent_bytes = 0
-    seq = 0
-    with open(filepath, 'rb') as f:
-        while True:
-            data = f.read(CHUNK)
-            if not data: break
-            pkt = struct.pack('!I H', seq, len(data)) + data + struct.pack('!I', zlib.crc32(data)&0xFFFFFFFF)
-            for attempt in range(CHUNK_RETRIES):
-                s.write(pkt)
-                r = s.read(7)  # blocking ACK/NAK + seq(4)
-                if not r:
-                    continue
-                if r.startswith(b'ACK'):
-                    ackseq = struct.unpack('!I', r[3:7])[0]
-                    if ackseq == seq:
-                        sent_bytes += len(data)
-                        progress_bar(sent_bytes, size)
-                        break
-                elif r.startswith(b'NAK'):
-                    time.sleep(0.05)
-                    continue
-            else:
-                print("\nFailed to send chunk seq", seq); s.close(); return
-            seq += 1
-    s.write(b'DONE')
-    progress_bar(size, size)
-    print("\nSend complete ->", filepath)
-    s.close()
+    eof = False
+    # hot loop: bind lookups to locals
+    ready_get, acks_get, free_put = ready.get, acks.get, free.put
+    unpack_seq, write = SEQ_STRUCT.unpack_from, write_parts
+    while not eof or pending:
+        while not eof and len(pending) < WINDOW:
+            item = ready_get()
+            if item is None:
+                eof = True; break
+            seq, i, off, n = item
+            write(s, fd, (views[i][:6], mmv[off:off + n], views[i][6:]))
+            pending[seq] = [i, off, n, 1]
+        if not pending:
+            break
+        try:
+            r = acks_get(timeout=ack_timeout)
+        except queue.Empty:
+            r = b'NAK' + SEQ_STRUCT.pack(min(pending))  # nothing heard: resend oldest
+        ackseq, = unpack_seq(r, 3)
+        if r.startswith(b'ACK'):
+            # cumulative: everything up to ackseq has been written by the receiver
+            for q in [q for q in pending if q <= ackseq]:
+                ent = pending.pop(q)
+                free_put(ent[0])
+                sent_bytes += ent[2]
+            progress_bar(sent_bytes, size)
+        elif r.startswith(b'NAK'):
+            ent = pending.get(ackseq)
+            if not ent:
+                continue
+            i, off, n, tries = ent
+            if tries >= CHUNK_RETRIES:
+                print("\nFailed to send chunk seq", ackseq)
+                return False
+            ent[3] += 1
+            write(s, fd, (views[i][:6], mmv[off:off + n], views[i][6:]))  # resend only the NAKed packet
+    return True
 
-def recv(port, outdir):
+def recv(port, outdir, passphrase=None):
     os.makedirs(outdir, exist_ok=True)
     s = serial.Serial(port, BAUD, timeout=None)
+    tune_port(s)
     # clear any stale bytes
     try:
         s.reset_input_buffer()
@@ -98,52 +300,121 @@ def recv(port, outdir):
     if hdr != b'FILE':
         print("Unexpected header:", hdr); s.close(); return
 
-    ln = struct.unpack('!B', s.read(1))[0]
-    fname = s.read(ln).decode()
-    size = struct.unpack('!Q', s.read(8))[0]
+    mb = s.read(2)
+    mode, ln = struct.unpack('!BB', mb)
+    name_b = s.read(ln)
+    size_b = s.read(8)
+    fname = name_b.decode()
+    size = struct.unpack('!Q', size_b)[0]
+    auth = None
+    if mode not in (MODE_CRC, MODE_AUTH):
+        print("Unknown header mode:", mode); s.close(); return
+    if passphrase and mode != MODE_AUTH:
+        # no downgrade: with a passphrase set, only authenticated transfers are accepted
+        print("Sender is not using auth mode; refusing the transfer."); s.close(); return
+    if mode == MODE_AUTH:
+        prefix = s.read(NONCE_PREFIX_LEN)
+        tag = s.read(TAG_LEN)
+        if not passphrase or AESGCM is None:
+            print("Sender uses auth mode: a passphrase and the cryptography package are required."); s.close(); return
+        auth = make_auth(passphrase, prefix)
+        if not hmac.compare_digest(gmac(auth, HDR_SEQ, b'FILE' + mb + name_b + size_b + prefix), tag):
+            print("Header authentication failed (wrong passphrase or forged header)."); s.close(); return
+    tlen = TAG_LEN if auth else 4
     outpath = os.path.join(outdir, fname)
 
     # show filename immediately
     print(f"Receiving file: {fname}  ({size} bytes) -> {outpath}")
     s.write(b'OK')
 
+    fd = raw_fd(s)
     recv_bytes = 0
-    with open(outpath, 'wb') as f:
+    expected = 0
+    acked = 0  # expected seq at the time of our last ACK
+    nak_for = -1  # gap we already asked the sender to fill
+    held = {}  # good packets that arrived ahead of a resend
+    slab = bytearray(0xFFFF + 6 + TAG_LEN)  # largest packet the !H length field allows
+    mv = memoryview(slab)
+    ack = bytearray(b'ACK\0\0\0\0')  # replies are patched in place with the seq
+    nak = bytearray(b'NAK\0\0\0\0')
+    # 1 MiB write buffer: ~32 chunks per write syscall instead of one each
+    with open(outpath, 'wb', buffering=WRITE_BUFFER) as f:
+        # hot loop: bind lookups to locals
+        fwrite, read, write, _crc32 = f.write, read_exact, write_all, crc32
+        unpack_hdr, unpack_crc, pack_seq = PKT_HDR.unpack_from, CRC_STRUCT.unpack_from, SEQ_STRUCT.pack_into
         while True:
-            hdr2 = s.read(6)
-            if hdr2 == b'DONE': break
-            if len(hdr2) < 6:
+            if read(s, fd, mv[:4]) < 4:
+                continue
+            if mv[:4] == b'DONE':
+                break
+            if read(s, fd, mv[4:6]) < 2:
                 continue
-            seq, length = struct.unpack('!I H', hdr2)
-            data = s.read(length)
-            crc_raw = s.read(4)
-            if len(data) != length or len(crc_raw) != 4:
-                s.write(b'NAK' + struct.pack('!I', seq))
+            seq, length = unpack_hdr(slab, 0)
+            if read(s, fd, mv[6:6 + length + tlen]) != length + tlen:  # payload + CRC/tag in one read
+                pack_seq(nak, 3, seq); write(s, fd, nak)
                 continue
-            crc = struct.unpack('!I', crc_raw)[0]
-            if zlib.crc32(data)&0xFFFFFFFF == crc:
-                f.write(data); recv_bytes += length
-                s.write(b'ACK' + struct.pack('!I', seq))
-                progress_bar(recv_bytes, size)
+            data = mv[6:6 + length]
+            if auth:
+                ok = hmac.compare_digest(gmac(auth, seq, data), mv[6 + length:6 + length + TAG_LEN])
             else:
-                s.write(b'NAK' + struct.pack('!I', seq))
+                ok = _crc32(data) == unpack_crc(slab, 6 + length)[0]
+            if not ok:
+                if seq == expected:
+                    nak_for = seq  # the next good packet must not NAK this gap again
+                pack_seq(nak, 3, seq); write(s, fd, nak)
+                continue
+            if seq < expected:
+                # duplicate of a resent packet: our ACK may have been lost, repeat it
+                pack_seq(ack, 3, expected - 1); write(s, fd, ack)
+                continue
+            if seq > expected:
+                held[seq] = bytes(data)  # slab is reused, keep a copy
+                if nak_for != expected:
+                    nak_for = expected
+                    pack_seq(nak, 3, expected); write(s, fd, nak)
+                continue
+            fwrite(data); recv_bytes += length
+            expected += 1
+            while expected in held:
+                data = held.pop(expected)
+                fwrite(data); recv_bytes += len(data)
+                expected += 1
+            if expected - acked >= ACK_EVERY or not s.in_waiting:
+                acked = expected
+                pack_seq(ack, 3, expected - 1); write(s, fd, ack)
+            progress_bar(recv_bytes, size)
 
     # ensure progress bar final newline so message visible
     print()
-    print("Received ->", outpath)
+    verified = True
+    if auth:
+        # tagged end marker: DONE + frame count + GMAC, so a forged or early DONE is caught
+        tail = bytearray(4 + TAG_LEN)
+        read_exact(s, fd, memoryview(tail))
+        count = SEQ_STRUCT.unpack_from(tail, 0)[0]
+        verified = count == expected and hmac.compare_digest(
+            gmac(auth, DONE_SEQ, b'DONE' + tail[:4]), tail[4:])
+    if recv_bytes != size or not verified:
+        print(f"[ERR] Transfer incomplete or end marker not authentic: {recv_bytes}/{size} bytes ->", outpath)
+    else:
+        print("Received ->", outpath, "(authenticated)" if auth else "")
     s.close()
 
 def main():
     print("=== USB Bridge File Transfer (blocking mode) ===")
+    print("CRC32 backend:", CRC_BACKEND)
     try:
         mode = input("Mode (send/recv): ").strip().lower()
         port = input("Serial port (e.g. COM3 or /dev/ttyUSB0): ").strip()
+        passphrase = getpass.getpass("Auth passphrase (blank = CRC32 only): ").strip() or None  # not echoed
+        if passphrase and AESGCM is None:
+            print("Auth mode needs the cryptography package: pip install cryptography"); return
         if mode == 'send':
             path = input("Path to file to send: ").strip()
-            send(port, path)
+            send(port, path, passphrase)
         elif mode == 'recv':
             outdir = input("Output folder path (default .): ").strip() or '.'
-            recv(port, outdir)
+            recv(port, outdir, passphrase)
         else:
             print("Invalid mode")
     except KeyboardInterrupt:
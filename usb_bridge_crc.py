@@ -0,0 +1,58 @@
+# -----------------------------------------------------------------------------
+#  USB Bridge Session — Secure File Transfer (FTDI)
+#
+#  Copyright (c) 2025 Nitish. All Rights Reserved.
+#
+#  License: Proprietary
+#  This software and its source code are the exclusive property of Nitish.
+#
+#  Permissions:
+#   - Use only with prior written permission from the copyright holder.
+#
+#  Restrictions:
+#   - No copying, modifying, merging, publishing, distributing, sublicensing,
+#     or selling.
+#   - No reverse engineering, decompiling, or disassembling.
+#
+#  Liability:
+#   - Provided "as is", without warranty of any kind.
+#
+#  Contact: nitish.ns378@gmail.com
+# -----------------------------------------------------------------------------
+
+"""
+usb_bridge_crc.py
+CRC32 (IEEE, same values as zlib.crc32) used for chunk checks.
+Backends, first one installed wins:
+  - fastcrc (pip install fastcrc): crc32.iso_hdlc, SIMD carry-less-multiply folding.
+  - ISA-L (pip install isal): PCLMULQDQ folding, or VPCLMULQDQ 64-byte stripes on
+    AVX-512 CPUs (Ice Lake / Zen 4+), PMULL/CRC32 on ARMv8 (Pi 4/5, Jetson) and
+    VPMSUMD on POWER8+; the kernel is picked from CPU feature flags at load time.
+    Tried first on ARM/POWER, where its hand-written kernels are the known-fast path.
+  - binascii: always available (e.g. 32-bit Raspberry Pi OS); the same zlib CRC32
+    as zlib.crc32 behind a slightly cheaper call.
+"""
+import platform
+
+def _fastcrc():
+    from fastcrc.crc32 import iso_hdlc
+    return iso_hdlc
+
+def _isal():
+    from isal.isal_zlib import crc32
+    return crc32
+
+if platform.machine().lower() in ('aarch64', 'arm64', 'ppc64le', 'ppc64'):
+    _ORDER = (('isal', _isal), ('fastcrc', _fastcrc))
+else:
+    _ORDER = (('fastcrc', _fastcrc), ('isal', _isal))
+
+for BACKEND, _load in _ORDER:
+    try:
+        crc32 = _load()
+        break
+    except ImportError:
+        pass
+else:
+    from binascii import crc32
+    BACKEND = 'binascii'
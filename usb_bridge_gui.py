@@ -13,7 +13,8 @@ Note: Place this file in same folder as usb_bridge_session.py (imports SerialBri
 
 import sys
 import os
-import re
+import codecs
+import socket
 import threading
 import time
 from queue import Queue, Empty
@@ -29,16 +30,14 @@ except Exception:
 
 
 # ---------- Helpers ----------
-PERC_RE = re.compile(r'([0-9]{1,3}\.[0-9]{2})%')
-KBPS_RE = re.compile(r'([0-9]+\.[0-9]{2})\s*KB/s')
-ETA_RE = re.compile(r'ETA\s+(\d{2}:\d{2})')
+PROGRESS_INTERVAL = 0.05  # forward at most ~20 progress updates a second
 
 def list_serial_ports():
     ports = serial.tools.list_ports.comports()
     return [p.device for p in ports]
 
 
-# Thread-safe stdout capture to emit prints to GUI
+# Thread-safe stdout capture; text goes to the GUI through emit_func
 class StdoutCatcher:
     def __init__(self, emit_func):
         self.emit = emit_func
@@ -68,38 +67,34 @@ class TransferWorker(QtCore.QObject):
         self.outdir = outdir or '.'
         self._stop = threading.Event()
         self._bridge = None
-
-    def _emit_from_stdout(self, s):
-        # normalize carriage returns
-        s = s.replace('\r', '\n')
-        for line in s.splitlines():
-            if not line.strip():
-                continue
-            self.log.emit(line)
-            # attempt to parse progress
-            m = PERC_RE.search(line)
-            kb = KBPS_RE.search(line)
-            eta = ETA_RE.search(line)
-            try:
-                perc = float(m.group(1)) if m else None
-                kbps = float(kb.group(1)) if kb else None
-                et = eta.group(1) if eta else None
-                if perc is not None:
-                    self.progress.emit(perc, kbps or 0.0, et or '--:--')
-            except Exception:
-                pass
+        self._last_progress = 0.0
+        # backend prints go into a socket pair; the GUI thread drains log_r when the OS
+        # reports it readable (QSocketNotifier), so many prints become one Qt event.
+        # socketpair rather than os.pipe: QSocketNotifier only watches sockets on Windows.
+        self.log_r, self._log_w = socket.socketpair()
+        self.log_r.setblocking(False)
+
+    def _write_log(self, text):
+        try:
+            self._log_w.sendall(text.encode('utf-8', 'replace'))
+        except OSError:
+            pass  # channel already closed by the GUI (worker finished)
+
+    def _on_progress(self, percent, kbps, eta):
+        # called by SerialBridge per chunk (sender or receiver thread)
+        now = time.monotonic()
+        if percent < 100.0 and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        self.progress.emit(percent, kbps, eta)
 
     def run(self):
-        # Redirect prints from SerialBridge to GUI via StdoutCatcher
-        catcher = StdoutCatcher(self._emit_from_stdout)
-        old_stdout = sys.stdout
-        sys.stdout = catcher
+        # SerialBridge prints reach the GUI through MainWindow's StdoutCatcher
         try:
             # make bridge
             self._bridge = SerialBridge(self.port)
         except Exception as e:
             self.log.emit(f"[ERR] Failed open port {self.port}: {e}")
-            sys.stdout = old_stdout
             self.finished.emit()
             return
 
@@ -107,19 +102,19 @@ class TransferWorker(QtCore.QObject):
             if self.mode == 'recv':
                 self.log.emit("[WORKER] Starting receiver loop...")
                 # start recv loop in background thread inside SerialBridge
-                self._bridge.start_recv_loop(self.outdir)
+                self._bridge.start_recv_loop(self.outdir, self._on_progress)
                 while not self._stop.is_set():
                     time.sleep(0.5)
             elif self.mode == 'send':
                 self.log.emit(f"[WORKER] Sending files: {self.files}")
-                # send_files is blocking. It prints progress which we capture.
-                self._bridge.send_files(self.files)
+                # send_files is blocking. Progress comes back through _on_progress.
+                self._bridge.send_files(self.files, self._on_progress)
             elif self.mode == 'both':
                 self.log.emit("[WORKER] Starting receiver in background and ready to send.")
-                self._bridge.start_recv_loop(self.outdir)
+                self._bridge.start_recv_loop(self.outdir, self._on_progress)
                 # send if files provided
                 if self.files:
-                    self._bridge.send_files(self.files)
+                    self._bridge.send_files(self.files, self._on_progress)
                 # stay alive as listener
                 while not self._stop.is_set():
                     time.sleep(0.5)
@@ -135,7 +130,6 @@ class TransferWorker(QtCore.QObject):
                     self._bridge.close()
             except Exception:
                 pass
-            sys.stdout = old_stdout
             self.finished.emit()
 
     def stop(self):
@@ -150,6 +144,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setMinimumSize(800, 520)
         self._worker_thread = None
         self._worker = None
+        self._workers = set()  # a stopped worker stays here until its finished signal
+        # redirect stdout once for the window's lifetime and route it to the current
+        # worker; per-worker swaps could restore a dead worker's catcher after Stop + Start
+        self._real_stdout = sys.stdout
+        sys.stdout = StdoutCatcher(self._route_stdout)
 
         # Main layout
         w = QtWidgets.QWidget()
@@ -288,16 +287,25 @@ class MainWindow(QtWidgets.QMainWindow):
         self.append_log(f"[UI] Starting mode={mode} port={port}")
 
         # create worker
-        self._worker = TransferWorker(port, mode, files_list, outdir)
-        self._worker.log.connect(self.append_log)
-        self._worker.progress.connect(self.update_progress)
-        self._worker.finished.connect(self.on_worker_finished)
+        worker = TransferWorker(port, mode, files_list, outdir)
+        worker.log.connect(self.append_log)
+        worker.progress.connect(self.update_progress)
+        worker.finished.connect(self.on_worker_finished)
+        # the log channel state lives on the worker: after Stop + Start the old worker can
+        # still be running, and its finish must only close its own socket pair
+        worker.log_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        worker.log_tail = ''
+        worker.log_notifier = QtCore.QSocketNotifier(worker.log_r.fileno(), QtCore.QSocketNotifier.Read, self)
+        worker.log_notifier.activated.connect(lambda _fd, w=worker: self.drain_log(w))
 
         # run worker in QThread
-        self._worker_thread = QtCore.QThread()
-        self._worker.moveToThread(self._worker_thread)
-        self._worker_thread.started.connect(self._worker.run)
-        self._worker_thread.start()
+        worker.qthread = QtCore.QThread()
+        worker.moveToThread(worker.qthread)
+        worker.qthread.started.connect(worker.run)
+        self._worker = worker
+        self._worker_thread = worker.qthread
+        self._workers.add(worker)
+        worker.qthread.start()
 
     def on_stop(self):
         self.append_log("[UI] Stopping...")
@@ -316,19 +324,66 @@ class MainWindow(QtWidgets.QMainWindow):
                 pass
         self.append_log("[UI] Stopped.")
 
+    def closeEvent(self, event):
+        sys.stdout = self._real_stdout
+        super().closeEvent(event)
+
+    def _route_stdout(self, text):
+        # any thread: backend prints go to the current worker's log channel
+        worker = self._worker
+        if worker is not None:
+            worker._write_log(text)
+        elif self._real_stdout is not None:
+            self._real_stdout.write(text)
+
+    def drain_log(self, worker):
+        chunks = []
+        while True:
+            try:
+                data = worker.log_r.recv(65536)
+            except (BlockingIOError, OSError):
+                break
+            if not data:
+                break
+            chunks.append(data)
+        if not chunks:
+            return
+        text = worker.log_tail + worker.log_decoder.decode(b''.join(chunks)).replace('\r', '\n')
+        *lines, worker.log_tail = text.split('\n')
+        lines = [l for l in lines if l.strip()]
+        if lines:
+            self.append_log('\n'.join(lines))
+
+    def _close_log_channel(self, worker):
+        self.drain_log(worker)
+        if worker.log_tail.strip():
+            self.append_log(worker.log_tail)
+        worker.log_tail = ''
+        worker.log_notifier.setEnabled(False)
+        worker.log_notifier.deleteLater()
+        worker.log_notifier = None
+        worker.log_r.close()
+        worker._log_w.close()
+
     def on_worker_finished(self):
+        # sender() is the worker that finished, which need not be self._worker
+        worker = self.sender()
+        if worker not in self._workers:
+            return
+        self._workers.discard(worker)
+        self._close_log_channel(worker)
         self.append_log("[WORKER] Finished.")
-        self.start_btn.setEnabled(True)
-        self.stop_btn.setEnabled(False)
         # ensure thread cleanup
-        if self._worker_thread:
-            try:
-                self._worker_thread.quit()
-                self._worker_thread.wait(500)
-            except Exception:
-                pass
-        self._worker = None
-        self._worker_thread = None
+        try:
+            worker.qthread.quit()
+            worker.qthread.wait(500)
+        except Exception:
+            pass
+        if worker is self._worker:
+            self.start_btn.setEnabled(True)
+            self.stop_btn.setEnabled(False)
+            self._worker = None
+            self._worker_thread = None
 
 
 def main():
@@ -0,0 +1,43 @@
+# -----------------------------------------------------------------------------
+#  USB Bridge Session — Secure File Transfer (FTDI)
+#
+#  Copyright (c) 2025 Nitish. All Rights Reserved.
+#
+#  License: Proprietary
+#  This software and its source code are the exclusive property of Nitish.
+#
+#  Permissions:
+#   - Use only with prior written permission from the copyright holder.
+#
+#  Restrictions:
+#   - No copying, modifying, merging, publishing, distributing, sublicensing,
+#     or selling.
+#   - No reverse engineering, decompiling, or disassembling.
+#
+#  Liability:
+#   - Provided "as is", without warranty of any kind.
+#
+#  Contact: nitish.ns378@gmail.com
+# -----------------------------------------------------------------------------
+
+"""
+usb_bridge_port.py
+Serial port tuning shared by usb_bridge_app.py and usb_bridge_session.py.
+"""
+import os
+
+def tune_port(ser):
+    # best effort: bigger driver buffers on Windows, 1 ms FTDI latency timer on Linux
+    # (the default 16 ms holds back short bursts such as ACKs)
+    if os.name == 'nt':
+        try:
+            ser.set_buffer_size(rx_size=1 << 20, tx_size=1 << 20)
+        except Exception:
+            pass
+        return
+    dev = os.path.basename(os.path.realpath(ser.port))
+    try:
+        with open(f'/sys/bus/usb-serial/devices/{dev}/latency_timer', 'w') as lt:
+            lt.write('1')
+    except OSError:
+        pass  # not an FTDI device or no write permission
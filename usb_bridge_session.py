@@ -27,15 +27,35 @@ usb_bridge_session.py
 Single-run session: send/recv/both. Single-line progress + KB/s + ETA.
 Requires: pyserial
 """
-import os, sys, struct, zlib, time, threading, traceback
+import os, sys, struct, time, mmap, queue, threading, traceback, collections
 from typing import List
 import serial
+from usb_bridge_crc import crc32
+from usb_bridge_port import tune_port
 
 # config
-CHUNK = 4096
+CHUNK = 32768        # default payload per packet; length field is !H so at most 65535
 BAUD = 2000000
 CHUNK_RETRIES = 5
 HEADER_RETRIES = 8
+WINDOW = 16          # frames in flight: next seq - oldest unacked seq
+PREFETCH = 4         # chunks read + CRC'd ahead of the send loop
+PROGRESS_INTERVAL = 1 / 30  # redraw / report progress at most ~30 times a second
+WRITE_BUFFER = 1 << 20  # receiver file buffer: one write() per MiB, not per chunk
+ACK_TIMEOUT = 1.0    # seconds on top of a full window's wire time before a resend
+
+# precompiled wire layouts
+_TAG_DATA = 0x01                  # first byte of every data frame
+_TAG_DONE = 0x00                  # first byte of the end-of-file frame
+_HDR = struct.Struct('!IH')       # seq, payload length (after the tag byte)
+# DONE frame: tag, b'DONE', frame count. The magic keeps the zero bytes of a re-sent
+# FILE header's size field (or any stray 0x00) from ending a file early.
+_DONE = struct.Struct('!B4sI')
+_CRC = struct.Struct('!I')
+_ACK = struct.Struct('!I')        # seq after b'ACK' / b'NAK'
+_FHDR_TAIL = struct.Struct('!Q')  # file size after the name
+_ACK_TAG = int.from_bytes(b'ACK', 'big')
+_NAK_TAG = int.from_bytes(b'NAK', 'big')
 
 def format_eta(seconds):
     if seconds is None or seconds == float('inf'):
@@ -43,31 +63,86 @@ def format_eta(seconds):
     m = int(seconds // 60); s = int(seconds % 60)
     return f"{m:02d}:{s:02d}"
 
-def progress_line(sent, total, start_t, width=34):
+def progress_stats(sent, total, start_t):
     pct = sent / total if total else 1.0
-    filled = int(width * pct)
-    bar = '[' + '#' * filled + '-' * (width - filled) + ']'
     elapsed = max(1e-6, time.perf_counter() - start_t)
     speed = sent / elapsed
     kbps = speed / 1024.0
     remaining = max(0, total - sent)
     eta = remaining / speed if speed > 0 else None
+    return pct, kbps, eta
+
+def progress_line(sent, total, start_t, width=34):
+    pct, kbps, eta = progress_stats(sent, total, start_t)
+    filled = int(width * pct)
+    bar = '[' + '#' * filled + '-' * (width - filled) + ']'
     return f"\r{bar} {pct*100:6.2f}% {sent}/{total} bytes  {kbps:7.2f} KB/s ETA {format_eta(eta)}", kbps, eta
 
+def report_progress(done, total, start_t, progress_cb=None, last=0.0):
+    # progress_cb(percent, kbps, eta_str) replaces the console bar (used by the GUI).
+    # `last` is the caller's previous report time and the new one is returned, so each
+    # transfer keeps its own rate limit ('both' mode runs two at once).
+    now = time.perf_counter()
+    if done != total and now - last < PROGRESS_INTERVAL:
+        return last
+    if progress_cb is None:
+        line, kbps, eta = progress_line(done, total, start_t)
+        print(line, end='', flush=True)
+    else:
+        pct, kbps, eta = progress_stats(done, total, start_t)
+        progress_cb(pct * 100, kbps, format_eta(eta))
+    return now
+
 class TransferError(Exception):
     pass
 
+class Framer:
+    """Buffered reads over the port: pull whatever is waiting in one call and
+    slice fields out of the buffer, instead of one ser.read() per field."""
+    def __init__(self, ser):
+        self.ser = ser
+        self.buf = bytearray()
+
+    def need(self, n):
+        # True once n bytes are buffered; False if the port timed out first
+        buf = self.buf; ser = self.ser
+        while len(buf) < n:
+            data = ser.read(max(n - len(buf), ser.in_waiting))
+            if not data:
+                return False
+            buf += data
+        return True
+
 class SerialBridge:
-    def __init__(self, port: str, blocking=True):
+    def __init__(self, port: str, blocking=True, chunk=CHUNK):
+        if not 0 < chunk <= 0xFFFF:
+            raise ValueError(f"chunk must be 1..65535 bytes, got {chunk}")
         self.port = port
         self.blocking = blocking
+        self.chunk = chunk
+        # a packet may queue behind a whole window at 10 bits per byte
+        self.ack_timeout = ACK_TIMEOUT + WINDOW * (chunk + 10) * 10 / BAUD
         try:
-            self.ser = serial.Serial(port, BAUD, timeout=None if blocking else 1)
+            # no flow control: the link is paced by the ACK window
+            self.ser = serial.Serial(port, BAUD, timeout=None if blocking else 1,
+                                     rtscts=False, xonxoff=False, dsrdtr=False)
+            tune_port(self.ser)
             self.ser.reset_input_buffer(); self.ser.reset_output_buffer()
         except Exception as e:
             raise e
         self.recv_thread = None
         self.recv_stop = threading.Event()
+        # one reader per port: while the recv loop runs it also routes OK/ACK/NAK
+        # replies to the outgoing transfer in self._tx, so 'both' mode never has
+        # two threads reading (and stealing each other's bytes)
+        self._tx = None
+        self._ok = threading.Event()
+        self._wlock = threading.Lock()  # packets and replies come from different threads
+        self._replies = collections.deque()
+        # frame buffers (tag + header + payload + CRC built in place) for the window plus prefetch
+        self._pktbufs = [bytearray(chunk + 11) for _ in range(WINDOW + PREFETCH)]
+        for buf in self._pktbufs:
+            buf[0] = _TAG_DATA
 
     def close(self):
         try:
@@ -78,8 +153,28 @@ class SerialBridge:
         except Exception:
             pass
 
+    def _write(self, data):
+        with self._wlock:
+            self.ser.write(data)
+        self._flush_replies()
+
+    def _send_reply(self, data):
+        self._replies.append(data)
+        self._flush_replies()
+
+    def _flush_replies(self):
+        # OK/ACK/NAK never wait behind a packet write: if the port is busy, the
+        # writer sends them when done. Otherwise two peers sending to each other
+        # both stop reading and their writes block forever.
+        while self._replies and self._wlock.acquire(blocking=False):
+            try:
+                while self._replies:
+                    self.ser.write(self._replies.popleft())
+            finally:
+                self._wlock.release()
+
     # Sending
-    def send_files(self, filepaths: List[str]):
+    def send_files(self, filepaths: List[str], progress_cb=None):
         for fp in filepaths:
             fp = fp.strip()
             if not fp:
@@ -88,7 +183,7 @@ class SerialBridge:
                 print(f"\n[ERR] File not found: {fp}")
                 continue
             try:
-                self._send_file(fp)
+                self._send_file(fp, progress_cb)
             except KeyboardInterrupt:
                 print("\n[SEND] Aborted by user.")
                 return
@@ -96,49 +191,86 @@ class SerialBridge:
                 print("\n[ERR] Send failed:", e)
                 traceback.print_exc()
 
-    def _send_file(self, filepath: str):
+    def _send_file(self, filepath: str, progress_cb=None):
         size = os.path.getsize(filepath)
         fname = os.path.basename(filepath).encode()
-        hdr = b'FILE' + struct.pack('!B', len(fname)) + fname + struct.pack('!Q', size)
+        hdr = b'FILE' + struct.pack('!B', len(fname)) + fname + _FHDR_TAIL.pack(size)
+        demux = self.recv_thread is not None and self.recv_thread.is_alive()
         # handshake
         for attempt in range(HEADER_RETRIES):
-            self.ser.write(hdr)
-            resp = self.ser.read(2)
-            if resp == b'OK':
+            self._ok.clear()
+            self._write(hdr)
+            if demux:
+                ok = self._ok.wait(ACK_TIMEOUT)
+            else:
+                ok = self.ser.read(2) == b'OK'
+            if ok:
                 break
             time.sleep(0.15)
         else:
             raise TransferError("No OK from receiver. Ensure receiver active.")
-        sent = 0; seq = 0; start_t = time.perf_counter()
+        start_t = time.perf_counter()
+        # inflight: seq -> [pkt, data_len, resend_deadline, tries, frame_buf]
+        inflight = {}; cond = threading.Condition(); stop = threading.Event()
+        free = queue.Queue(); ready = queue.Queue(maxsize=PREFETCH)
+        for buf in self._pktbufs:
+            free.put(buf)
+        state = {'sent': 0, 'shown': 0, 'last_print': 0.0, 'err': None, 'eof': False}
+        tx = (inflight, free, cond, state)
         with open(filepath, 'rb') as f:
+            # payload is copied straight from the page cache; empty files cannot be mapped
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        mmv = memoryview(mm if mm is not None else b'')
+        if demux:
+            reader = None
+            self._tx = tx
+        else:
+            reader = threading.Thread(target=self._ack_reader, args=(Framer(self.ser), tx, stop), daemon=True)
+            reader.start()
+        framer = threading.Thread(target=self._fill_frames, args=(mmv, free, ready, stop), daemon=True)
+        framer.start()
+        nframes = 0
+        try:
             while True:
-                data = f.read(CHUNK)
-                if not data:
+                self._wait_window(inflight, cond, state, nframes, size, start_t, progress_cb)
+                item = ready.get()
+                if item is None:
                     break
-                pkt = struct.pack('!I H', seq, len(data)) + data + struct.pack('!I', zlib.crc32(data) & 0xFFFFFFFF)
-                for attempt in range(CHUNK_RETRIES):
-                    self.ser.write(pkt)
-                    ack = self.ser.read(7)
-                    if not ack:
-                        time.sleep(0.05); continue
-                    if ack.startswith(b'ACK'):
-                        ackseq = struct.unpack('!I', ack[3:7])[0]
-                        if ackseq == seq:
-                            sent += len(data)
-                            line, kbps, eta = progress_line(sent, size, start_t)
-                            print(line, end='', flush=True)
-                            break
-                        else:
-                            continue
-                    elif ack.startswith(b'NAK'):
-                        time.sleep(0.05); continue
-                    else:
-                        time.sleep(0.05); continue
-                else:
-                    raise TransferError(f"Chunk seq {seq} failed after retries.")
-                seq += 1
+                if isinstance(item, Exception):
+                    raise TransferError(f"File read failed: {item}")
+                seq, n, buf, pkt = item
+                with cond:
+                    inflight[seq] = [pkt, n, time.perf_counter() + self.ack_timeout, 0, buf]
+                self._write(pkt)
+                nframes += 1
+            with cond:
+                state['eof'] = True
+            self._wait_window(inflight, cond, state, None, size, start_t, progress_cb)
+        finally:
+            stop.set()
+            free.put(None)  # wake the framer if it waits for a buffer
+            try:
+                while True:
+                    ready.get_nowait()
+            except queue.Empty:
+                pass
+            framer.join(timeout=1)
+            if not framer.is_alive():
+                mmv.release()
+                if mm is not None:
+                    mm.close()
+            self._tx = None
+            # the reader exits on its own after the last ACK; wake it only if still blocked
+            if reader is not None:
+                reader.join(timeout=0.1)
+            if reader is not None and reader.is_alive():
+                try:
+                    self.ser.cancel_read()
+                except Exception:
+                    pass
+                reader.join(timeout=1)
         # DONE marker and flush
-        self.ser.write(b'DONE')
+        self._write(_DONE.pack(_TAG_DONE, b'DONE', nframes))
         try:
             self.ser.flush()
         except Exception:
@@ -147,63 +279,222 @@ class SerialBridge:
         print(line)  # newline after finish
         print(f"[+] Sent: {os.path.basename(filepath)} ({size} bytes) @ {kbps:7.2f} KB/s")
 
+    def _fill_frames(self, mmv, free, ready, stop):
+        # producer: frames and CRCs the next chunks while earlier ones are on the wire
+        seq = 0; chunk = self.chunk
+        try:
+            for off in range(0, len(mmv), chunk):
+                buf = free.get()
+                if buf is None or stop.is_set():
+                    break
+                with mmv[off:off + chunk] as data:
+                    n = len(data)
+                    _HDR.pack_into(buf, 1, seq, n)
+                    buf[7:7 + n] = data
+                    _CRC.pack_into(buf, 7 + n, crc32(data))
+                ready.put((seq, n, buf, memoryview(buf)[:11 + n]))
+                seq += 1
+        except Exception as e:
+            if not stop.is_set():
+                ready.put(e)
+        ready.put(None)
+
+    def _ack_reader(self, fr, tx, stop):
+        # send-only mode: nobody else reads the port, so replies are read here
+        inflight, free, cond, state = tx
+        buf = fr.buf
+        try:
+            while not stop.is_set():
+                with cond:
+                    if state['eof'] and not inflight:
+                        return
+                if not fr.need(7):
+                    continue
+                tag = buf[0] << 16 | buf[1] << 8 | buf[2]
+                if tag != _ACK_TAG and tag != _NAK_TAG:
+                    del buf[:1]  # resync on garbage
+                    continue
+                seq = _ACK.unpack_from(buf, 3)[0]
+                del buf[:7]
+                self._on_reply(tx, tag, seq)
+        except Exception as e:
+            if not stop.is_set():
+                with cond:
+                    state['err'] = e
+                    cond.notify()
+
+    def _on_reply(self, tx, tag, seq):
+        # pops ACKed seqs from inflight; a NAK makes the packet due for resend now
+        inflight, free, cond, state = tx
+        with cond:
+            ent = inflight.get(seq)
+            if ent is None:
+                return  # duplicate or stale reply
+            if tag == _ACK_TAG:
+                del inflight[seq]
+                free.put(ent[4])
+                state['sent'] += ent[1]
+            else:
+                ent[2] = 0.0
+            cond.notify()
+
+    def _wait_window(self, inflight, cond, state, next_seq, size, start_t, progress_cb):
+        # block until seq next_seq fits the window (next_seq - oldest unacked < WINDOW),
+        # or with next_seq None until everything is ACKed. NAKed/expired packets are
+        # resent on every pass: the receiver ACKs out-of-order frames too, so a count of
+        # unacked packets would let one bad frame wait for the end of the file.
+        while True:
+            with cond:
+                if state['err'] is not None:
+                    raise TransferError(f"ACK reader failed: {state['err']}")
+                sent = state['sent']
+                now = time.perf_counter()
+                due = [(s, e) for s, e in inflight.items() if e[2] <= now]
+                for s, e in due:
+                    e[3] += 1
+                    if e[3] > CHUNK_RETRIES:
+                        raise TransferError(f"Chunk seq {s} failed after retries.")
+                    e[2] = now + self.ack_timeout
+                if not inflight:
+                    ready = True
+                else:
+                    ready = next_seq is not None and next_seq - min(inflight) < WINDOW
+                if not due and not ready:
+                    cond.wait(min(e[2] for e in inflight.values()) - now)
+            if sent != state['shown']:
+                state['shown'] = sent
+                state['last_print'] = report_progress(sent, size, start_t, progress_cb, state['last_print'])
+            for s, e in due:
+                self._write(e[0])
+            if ready:
+                return
+
+    def _take_reply(self, fr):
+        # consumes an OK/ACK/NAK for our own transfer at the head of the buffer.
+        # Data/DONE frames start with tag 0x01/0x00, so the first byte tells them apart.
+        buf = fr.buf
+        if buf[0] == 0x4F and buf[1] == 0x4B:  # b'OK'
+            del buf[:2]
+            self._ok.set()
+            return True
+        if buf[0] != 0x41 and buf[0] != 0x4E:  # 'A' / 'N'
+            return False
+        if not fr.need(7):
+            return True  # timed out mid-reply; look again on the next pass
+        tag = buf[0] << 16 | buf[1] << 8 | buf[2]
+        if tag != _ACK_TAG and tag != _NAK_TAG:
+            return False
+        seq = _ACK.unpack_from(buf, 3)[0]
+        del buf[:7]
+        tx = self._tx
+        if tx is not None:
+            self._on_reply(tx, tag, seq)
+        return True
+
+    def _take_file_header(self, fr):
+        # FILE LEN(1) name SIZE(8) at the head of the buffer -> (name, size),
+        # None if the port timed out before the header was complete
+        buf = fr.buf
+        if not fr.need(5):
+            return None
+        ln = buf[4]
+        if not fr.need(5 + ln + 8):
+            return None
+        name = buf[5:5 + ln].decode(errors='ignore')
+        size = _FHDR_TAIL.unpack_from(buf, 5 + ln)[0]
+        del buf[:5 + ln + 8]
+        return name, size
+
     # Receiving (loop)
-    def start_recv_loop(self, outdir: str = '.'):
+    def start_recv_loop(self, outdir: str = '.', progress_cb=None):
         self.recv_stop.clear()
-        self.recv_thread = threading.Thread(target=self._recv_loop, args=(outdir,), daemon=True)
+        self.recv_thread = threading.Thread(target=self._recv_loop, args=(outdir, progress_cb), daemon=True)
         self.recv_thread.start()
 
-    def _recv_loop(self, outdir: str):
+    def _recv_loop(self, outdir: str, progress_cb=None):
         os.makedirs(outdir, exist_ok=True)
         print(f"[RECV] Listening on {self.port}. Save to: {os.path.abspath(outdir)}")
         try:
+            fr = Framer(self.ser); buf = fr.buf
             while not self.recv_stop.is_set():
-                hdr = self.ser.read(4)
-                if not hdr:
+                if not fr.need(2):
+                    continue
+                if self._take_reply(fr):
                     continue
-                if hdr != b'FILE':
-                    # skip stray bytes
+                if not fr.need(4):
                     continue
-                ln_b = self.ser.read(1)
-                if not ln_b:
+                if buf[:4] != b'FILE':
+                    # skip stray bytes up to the next FILE marker
+                    i = buf.find(b'FILE')
+                    del buf[:i if i > 0 else len(buf) - 3]
                     continue
-                ln = struct.unpack('!B', ln_b)[0]
-                name = self.ser.read(ln).decode(errors='ignore')
-                size_b = self.ser.read(8)
-                if len(size_b) < 8:
+                hdr = self._take_file_header(fr)
+                if hdr is None:
                     continue
-                size = struct.unpack('!Q', size_b)[0]
+                name, size = hdr
                 outpath = os.path.join(outdir, name)
                 print(f"\n[RECV] Incoming: {name} ({size} bytes) -> {outpath}")
                 # ack header
-                self.ser.write(b'OK')
+                self._send_reply(b'OK')
                 received = 0; start_t = time.perf_counter()
-                with open(outpath, 'wb') as f:
+                # packets can arrive out of order once a resend overtakes the window
+                expected = 0; held = {}; last_print = 0.0
+                with open(outpath, 'wb', buffering=WRITE_BUFFER) as f:
                     while True:
-                        peek = self.ser.read(4)
-                        if not peek:
+                        if not fr.need(1):
+                            continue
+                        tag = buf[0]
+                        if tag == _TAG_DONE:
+                            if not fr.need(_DONE.size):
+                                continue
+                            _, magic, count = _DONE.unpack_from(buf)
+                            if magic == b'DONE' and count == expected:
+                                del buf[:_DONE.size]
+                                break
+                            del buf[:1]  # a 0x00 that is not our DONE: resync
+                            continue
+                        if tag != _TAG_DATA:
+                            if not fr.need(2):
+                                continue
+                            if self._take_reply(fr):
+                                continue
+                            if tag == 0x46 and expected == 0:  # 'F'
+                                if not fr.need(4):
+                                    continue
+                                if buf[:4] == b'FILE':
+                                    # the sender re-sent its header (our OK was late or lost)
+                                    if self._take_file_header(fr) is not None:
+                                        self._send_reply(b'OK')
+                                    continue
+                            del buf[:1]  # resync on garbage
+                            continue
+                        if not fr.need(7):
                             continue
-                        if peek == b'DONE':
-                            break
-                        rest = self.ser.read(2)
-                        if len(rest) < 2:
+                        seq, length = _HDR.unpack_from(buf, 1)
+                        end = 7 + length + 4
+                        if not fr.need(end):
                             continue
-                        hdr2 = peek + rest
-                        seq, length = struct.unpack('!I H', hdr2)
-                        data = self.ser.read(length)
-                        crc_raw = self.ser.read(4)
-                        if len(data) != length or len(crc_raw) != 4:
-                            self.ser.write(b'NAK' + struct.pack('!I', seq))
+                        # views must be released before the buffer is trimmed
+                        with memoryview(buf) as mv:
+                            data = mv[7:7 + length]
+                            ok = crc32(data) == _CRC.unpack_from(buf, 7 + length)[0]
+                            if ok and seq == expected:
+                                f.write(data)
+                            elif ok and seq > expected:
+                                held[seq] = bytes(data)
+                            data.release()
+                        del buf[:end]
+                        if not ok:
+                            self._send_reply(b'NAK' + _ACK.pack(seq))
                             continue
-                        crc = struct.unpack('!I', crc_raw)[0]
-                        if zlib.crc32(data) & 0xFFFFFFFF == crc:
-                            f.write(data)
-                            received += length
-                            self.ser.write(b'ACK' + struct.pack('!I', seq))
-                            line, kbps, eta = progress_line(received, size, start_t)
-                            print(line, end='', flush=True)
-                        else:
-                            self.ser.write(b'NAK' + struct.pack('!I', seq))
+                        self._send_reply(b'ACK' + _ACK.pack(seq))
+                        if seq == expected:
+                            received += length; expected += 1
+                            while expected in held:
+                                data = held.pop(expected)
+                                f.write(data)
+                                received += len(data); expected += 1
+                            last_print = report_progress(received, size, start_t, progress_cb, last_print)
                 line, kbps, eta = progress_line(size, size, start_t)
                 print(line)
                 print(f"[+] Received: {name} -> {outpath} @ {kbps:7.2f} KB/s")
@@ -22,13 +22,21 @@
 #  Contact: nitish.ns378@gmail.com
 # -----------------------------------------------------------------------------
 
-import sys,os,struct,zlib,time
+import sys,os,struct,time
 import serial
+from usb_bridge_crc import crc32
 
 CHUNK=4096
 BAUD=115200
-TO=1
+TO=1  # handshake / header scan: finite, so the retry loop and the 20 s scan timeout work
+DATA_TO=2  # data phase: reads return as soon as bytes arrive; a lost byte costs one retry, not a hang
 RETRIES=5
+_HDR=struct.Struct('!IH')  # seq,len
+_CRC=struct.Struct('!I')
+_ACK=struct.Struct('!I')  # seq after ACK/NAK
+_FHDR_TAIL=struct.Struct('!Q')  # size
+_ACK_TAG=int.from_bytes(b'ACK','big')
+_NAK_TAG=int.from_bytes(b'NAK','big')
 
 def hexd(b): return b.hex()
 
@@ -36,7 +44,7 @@ def send(port,filepath):
     s=serial.Serial(port,BAUD,timeout=TO)
     fname=os.path.basename(filepath).encode()
     size=os.path.getsize(filepath)
-    hdr=b'FILE'+struct.pack('!B',len(fname))+fname+struct.pack('!Q',size)
+    hdr=b'FILE'+struct.pack('!B',len(fname))+fname+_FHDR_TAIL.pack(size)
     print("[SEND] header:",hdr, "hex:",hexd(hdr))
     # send header until OK
     for attempt in range(50):
@@ -48,21 +56,24 @@ def send(port,filepath):
         time.sleep(0.5)
     else:
         print("No OK from receiver. Stop."); return
+    s.timeout=DATA_TO
     with open(filepath,'rb') as f:
         seq=0
         while True:
             data=f.read(CHUNK)
             if not data: break
-            pkt=struct.pack('!I H',seq,len(data))+data+struct.pack('!I',zlib.crc32(data)&0xFFFFFFFF)
-            print(f"[SEND] seq={seq} len={len(data)} crc={zlib.crc32(data)&0xFFFFFFFF}")
+            crc=crc32(data)
+            pkt=b''.join((_HDR.pack(seq,len(data)),data,_CRC.pack(crc)))
+            print(f"[SEND] seq={seq} len={len(data)} crc={crc}")
             for _ in range(RETRIES):
                 s.write(pkt)
                 r=s.read(7)  # ACK/NAK + seq(4)
                 print("[SEND] ack raw:",r, "hex:",hexd(r))
-                if r.startswith(b'ACK'):
-                    ackseq=struct.unpack('!I',r[3:7])[0]
-                    if ackseq==seq: break
-                time.sleep(0.2)
+                tag=r[0]<<16|r[1]<<8|r[2] if len(r)==7 else 0
+                if tag==_ACK_TAG:
+                    if _ACK.unpack_from(r,3)[0]==seq: break
+                elif tag==_NAK_TAG:
+                    time.sleep(0.05)  # NAK backoff
             else:
                 print("Failed seq",seq); return
             seq+=1
@@ -71,15 +82,16 @@ def send(port,filepath):
 def recv(port,outdir):
     s=serial.Serial(port,BAUD,timeout=TO)
     print("[RECV] listening for header...")
-    buf=b''
+    buf=bytearray(); skipped=0
     start=time.time()
     while True:
-        b=s.read(1)
-        if b: buf+=b
-        if b'FILE' in buf: break
+        buf+=s.read(s.in_waiting or 1)  # whatever is queued, else block for 1 byte
+        idx=buf.find(b'FILE')
+        if idx!=-1: break
+        # garbage: keep only a possible partial marker, so each find is O(new bytes)
+        skipped+=max(0,len(buf)-3); del buf[:-3]
         if time.time()-start>20:
-            print("Timeout waiting FILE header. Got:",buf); return
-    idx=buf.find(b'FILE')
+            print("Timeout waiting FILE header. Skipped",skipped,"bytes, tail:",bytes(buf)); return
     # consume rest if any
     rest=buf[idx+4:]
     ln=b''
@@ -88,31 +100,36 @@ def recv(port,outdir):
         rest+=s.read(1)
     ln_len=rest[0]
     while len(rest)<1+ln_len+8:
-        rest+=s.read(1)
+        rest+=s.read(1+ln_len+8-len(rest))
     fname=rest[1:1+ln_len].decode()
-    size=struct.unpack('!Q',rest[1+ln_len:1+ln_len+8])[0]
+    size=_FHDR_TAIL.unpack_from(rest,1+ln_len)[0]
     print(f"[RECV] fname={fname} size={size}")
     s.write(b'OK')
+    s.timeout=DATA_TO
     outpath=os.path.join(outdir,fname)
     with open(outpath,'wb') as f:
         recvbytes=0
         while True:
-            hdr=s.read(6)
-            if not hdr:
-                time.sleep(0.05); continue
+            hdr=s.read(4)
+            if not hdr: continue  # idle line, keep waiting for the sender
             if hdr==b'DONE': break
+            hdr+=s.read(2)
             if len(hdr)<6:
                 print("Short hdr:",hdr); continue
-            seq,lenb=struct.unpack('!I H',hdr)
+            seq,lenb=_HDR.unpack(hdr)
             data=s.read(lenb)
             crc_raw=s.read(4)
-            crc=struct.unpack('!I',crc_raw)[0]
+            if len(data)!=lenb or len(crc_raw)!=4:
+                # truncated packet: NAK it instead of unpacking a short CRC
+                print(f"[RECV] seq={seq} short packet gotlen={len(data)}")
+                s.write(b'NAK'+_ACK.pack(seq)); continue
+            crc=_CRC.unpack(crc_raw)[0]
             print(f"[RECV] seq={seq} len={lenb} crc={crc} gotlen={len(data)}")
-            if zlib.crc32(data)&0xFFFFFFFF==crc:
+            if crc32(data)==crc:
                 f.write(data); recvbytes+=lenb
-                s.write(b'ACK'+struct.pack('!I',seq))
+                s.write(b'ACK'+_ACK.pack(seq))
             else:
-                s.write(b'NAK'+struct.pack('!I',seq))
+                s.write(b'NAK'+_ACK.pack(seq))
     print("Recv done",recvbytes,"->",outpath)
 
 if __name__=='__main__':